@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
 
+import itertools
 import logging
-from typing import Callable, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import reagent.core.types as rlt
@@ -19,16 +20,65 @@ logger = logging.getLogger(__name__)
 class Compose:
     """
     Applies an iterable collection of transform functions
+
+    If `device` is given, transforms that support it (i.e., have a `to()` method)
+        are moved to that device; see `to()`.
     """
 
-    def __init__(self, *transforms):
+    def __init__(self, *transforms, device: Optional[torch.device] = None):
         self.transforms = transforms
+        if device is not None:
+            self.to(device)
+
+    def to(self, device: torch.device) -> "Compose":
+        """
+        Moves the transforms to `device`, so they can run after the batch has been
+        transferred there (e.g., on GPU, with a DataLoader using `pin_memory=True`)
+        instead of on CPU inside the DataLoader workers.
+        Transforms without a `to()` method are left as is.
+        """
+        for t in self.transforms:
+            to = getattr(t, "to", None)
+            if to is not None:
+                to(device)
+        return self
 
     def __call__(self, data):
         for t in self.transforms:
             data = t(data)
         return data
 
+    def compile(self) -> "Compose":
+        """
+        Returns an equivalent Compose where every run of consecutive transforms
+        that can be expressed as a TorchScript module (see `to_script_module()`)
+        is replaced by a single scripted module. Other transforms are kept as is.
+        """
+        transforms = []
+        modules: List[torch.nn.Module] = []
+        for t in self.transforms:
+            to_script_module = getattr(t, "to_script_module", None)
+            module = to_script_module() if to_script_module is not None else None
+            if module is not None:
+                modules.append(module)
+                continue
+            if modules:
+                transforms.append(ScriptedTransforms(modules))
+                modules = []
+            transforms.append(t)
+        if modules:
+            transforms.append(ScriptedTransforms(modules))
+        return Compose(*transforms)
+
+    def specialize(self) -> "SpecializedTransforms":
+        """
+        Returns an equivalent callable generated from the source of the transforms
+        (see `specialize_source()`), with their attributes baked in as constants.
+        Transforms that don't support it are called as is.
+        Changes to the attributes of the transforms after this call aren't picked up.
+        """
+        return SpecializedTransforms(self.transforms)
+
     def __repr__(self):
         transforms = "\n    ".join([repr(t) for t in self.transforms])
         return f"{self.__class__.__name__}(\n{transforms}\n)"
@@ -41,14 +91,18 @@ class ValuePresence:
     replace `x` with tuple of `x` and `x_presence`, delete `x_presence` key
     """
 
+    SUFFIX = "_presence"
+
     def __call__(self, data):
-        keys = list(data.keys())
+        suffix_len = len(self.SUFFIX)
+        keys = [
+            k[:-suffix_len]
+            for k in data
+            if k.endswith(self.SUFFIX) and k[:-suffix_len] in data
+        ]
 
         for k in keys:
-            presence_key = f"{k}_presence"
-            if presence_key in data:
-                data[k] = (data[k], data[presence_key])
-                del data[presence_key]
+            data[k] = (data[k], data.pop(f"{k}{self.SUFFIX}"))
 
         return data
 
@@ -96,34 +150,72 @@ class DenseNormalization:
         keys: List[str],
         normalization_data: NormalizationData,
         device: Optional[torch.device] = None,
+        non_blocking: bool = False,
+        fuse_keys: bool = False,
     ):
         """
         Args:
             keys: the name of the keys to be transformed
+            non_blocking: passed to `Tensor.to()` when moving the inputs to
+                `device`; only useful when the inputs are in pinned memory
+            fuse_keys: if set, the keys are stacked along the batch dimension and
+                normalized with a single preprocessor call, then split back
         """
         self.keys = keys
         self.normalization_data = normalization_data
         self.device = device or torch.device("cpu")
-        # Delay the initialization of the preprocessor so this class
-        # is pickleable
-        self._preprocessor: Optional[Preprocessor] = None
+        self.non_blocking = non_blocking
+        self.fuse_keys = fuse_keys
+        # Build the preprocessor eagerly so the cost isn't paid on the first batch;
+        # it's dropped when pickled (see __getstate__) and rebuilt lazily
+        self._preprocessor: Optional[Preprocessor] = self._build_preprocessor()
+
+    def _build_preprocessor(self) -> Preprocessor:
+        return Preprocessor(
+            self.normalization_data.dense_normalization_parameters,
+            device=self.device,
+        )
+
+    def to(self, device: torch.device) -> "DenseNormalization":
+        self.device = device
+        self._preprocessor = self._build_preprocessor()
+        return self
+
+    def __getstate__(self):
+        # Exclude the preprocessor so this class is pickleable
+        state = self.__dict__.copy()
+        state["_preprocessor"] = None
+        return state
 
     def __call__(self, data):
         if self._preprocessor is None:
-            self._preprocessor = Preprocessor(
-                self.normalization_data.dense_normalization_parameters,
-                device=self.device,
+            self._preprocessor = self._build_preprocessor()
+
+        if self.fuse_keys and len(self.keys) > 1:
+            value_presence = [data[k] for k in self.keys]
+            value = torch.cat([v for v, _ in value_presence])
+            presence = torch.cat([p for _, p in value_presence])
+            outputs = self._normalize(value, presence).split(
+                [v.shape[0] for v, _ in value_presence]
             )
+            for k, output in zip(self.keys, outputs):
+                data[k] = output
+            return data
 
         for k in self.keys:
             value, presence = data[k]
-            value, presence = value.to(self.device), presence.to(self.device)
-            presence[torch.isnan(value)] = 0
-            value[torch.isnan(value)] = 0
-            data[k] = self._preprocessor(value, presence).float()
+            data[k] = self._normalize(value, presence)
 
         return data
 
+    def _normalize(self, value: torch.Tensor, presence: torch.Tensor) -> torch.Tensor:
+        value = value.to(self.device, non_blocking=self.non_blocking)
+        presence = presence.to(self.device, non_blocking=self.non_blocking)
+        nan_mask = torch.isnan(value)
+        presence.masked_fill_(nan_mask, 0)
+        value.masked_fill_(nan_mask, 0)
+        return self._preprocessor(value, presence).float()
+
 
 class MapIDListFeatures:
     """
@@ -146,19 +238,36 @@ class MapIDListFeatures:
         self.sparse_preprocessor = make_sparse_preprocessor(
             feature_config=feature_config, device=device
         )
+        # if no ids, it means we're not using sparse features.
+        self._use_sparse_features = bool(feature_config.id2name)
+
+    def to(self, device: torch.device) -> "MapIDListFeatures":
+        self.sparse_preprocessor = make_sparse_preprocessor(
+            feature_config=self.feature_config, device=device
+        )
+        return self
 
     def __call__(self, data):
-        for k in self.id_list_keys + self.id_score_list_keys:
-            # if no ids, it means we're not using sparse features.
-            if not self.feature_config.id2name or k not in data:
+        if not self._use_sparse_features:
+            for k in itertools.chain(self.id_list_keys, self.id_score_list_keys):
                 data[k] = None
-                continue
-
-            assert isinstance(data[k], dict), f"{k} has type {type(data[k])}. {data[k]}"
-            if k in self.id_list_keys:
-                data[k] = self.sparse_preprocessor.preprocess_id_list(data[k])
-            else:
-                data[k] = self.sparse_preprocessor.preprocess_id_score_list(data[k])
+            return data
+
+        for keys, preprocess in (
+            (self.id_list_keys, self.sparse_preprocessor.preprocess_id_list),
+            (
+                self.id_score_list_keys,
+                self.sparse_preprocessor.preprocess_id_score_list,
+            ),
+        ):
+            for k in keys:
+                if k not in data:
+                    data[k] = None
+                    continue
+                assert isinstance(
+                    data[k], dict
+                ), f"{k} has type {type(data[k])}. {data[k]}"
+                data[k] = preprocess(data[k])
         return data
 
 
@@ -174,13 +283,30 @@ class OneHotActions:
 
     def __call__(self, data):
         for k in self.keys:
-            # we do + 1 and then index up to n because value could be num_actions,
-            # in which case the result is a zero-vector
-            data[k] = F.one_hot(data[k], self.num_actions + 1).index_select(
-                -1, torch.arange(self.num_actions)
+            # value could be num_actions, in which case the result is a zero-vector;
+            # encode it as action 0 and zero out the row afterwards
+            invalid = data[k] == self.num_actions
+            value = data[k].masked_fill(invalid, 0)
+            data[k] = F.one_hot(value, self.num_actions).masked_fill_(
+                invalid.unsqueeze(-1), 0
             )
         return data
 
+    def to_script_module(self) -> torch.nn.Module:
+        return _OneHotActionsModule(self.keys, self.num_actions)
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        n = _literal(self.num_actions, bind)
+        lines = []
+        for k in self.keys:
+            k = _literal(k, bind)
+            lines += [
+                f"invalid = data[{k}] == {n}",
+                f"data[{k}] = F.one_hot(data[{k}].masked_fill(invalid, 0), {n})"
+                ".masked_fill_(invalid.unsqueeze(-1), 0)",
+            ]
+        return lines
+
 
 class ColumnVector:
     """
@@ -193,24 +319,27 @@ class ColumnVector:
     def __call__(self, data):
         for k in self.keys:
             raw_value = data[k]
-            if isinstance(raw_value, tuple):
+            if isinstance(raw_value, torch.Tensor):
+                # TODO(T67265031): this is an identity mapping, which is only necessary
+                # when mdp_id in traced batch preprocessors becomes a tensor (mdp_id
+                # is a list of strings in normal batch preprocessors).
+                value = raw_value
+            elif isinstance(raw_value, tuple):
                 value, _presence = raw_value
             elif isinstance(raw_value, list):
                 # TODO(T67265031): make mdp_id a tensor, which we will be able to
                 # when column type changes to int
                 value = np.array(raw_value)
-            elif isinstance(raw_value, torch.Tensor):
-                # TODO(T67265031): this is an identity mapping, which is only necessary
-                # when mdp_id in traced batch preprocessors becomes a tensor (mdp_id
-                # is a list of strings in normal batch preprocessors).
-                value = raw_value
             else:
                 raise NotImplementedError(f"value of type {type(raw_value)}.")
 
-            assert value.ndim == 1 or (
-                value.ndim == 2 and value.shape[1] == 1
-            ), f"Invalid shape for key {k}: {value.shape}"
-            data[k] = value.reshape(-1, 1)
+            if value.ndim == 2:
+                # Already a column vector; nothing to reshape
+                assert value.shape[1] == 1, f"Invalid shape for key {k}: {value.shape}"
+                data[k] = value
+            else:
+                assert value.ndim == 1, f"Invalid shape for key {k}: {value.shape}"
+                data[k] = value.reshape(-1, 1)
 
         return data
 
@@ -235,7 +364,14 @@ class MaskByPresence:
                 f"Unmatching value shape ({value.shape})"
                 f" and presence shape ({presence.shape})"
             )
-            data[k] = value * presence.float()
+            if presence.dtype == torch.bool and value.dtype == torch.promote_types(
+                value.dtype, torch.float
+            ):
+                # Bool is promoted inside the kernel, without materializing a float
+                # copy of presence; the result is the same as below (NaN * 0 is NaN)
+                data[k] = value * presence
+            else:
+                data[k] = value * presence.float()
 
         return data
 
@@ -262,13 +398,23 @@ class StackDenseFixedSizeArray:
                 data[k] = value.to(self.dtype)
             else:
                 # Assuming that value is List[Tuple[torch.Tensor, torch.Tensor]]
-                data[k] = (
-                    torch.cat([v for v, p in value], dim=0)
-                    .view(-1, self.size)
-                    .to(dtype=self.dtype)
-                )
+                data[k] = self._stack(value)
         return data
 
+    def _stack(self, value) -> torch.Tensor:
+        # Copy straight into the output buffer, casting to dtype along the way,
+        # instead of concatenating first and casting afterwards
+        total_rows = sum(v.numel() for v, _ in value) // self.size
+        out = torch.empty(
+            (total_rows, self.size), dtype=self.dtype, device=value[0][0].device
+        )
+        offset = 0
+        for v, _ in value:
+            v = v.reshape(-1, self.size)
+            out[offset : offset + v.shape[0]].copy_(v)
+            offset += v.shape[0]
+        return out
+
 
 class FixedLengthSequences:
     """
@@ -319,10 +465,15 @@ class FixedLengthSequences:
                     expected_length = value[0].shape[0]
                 self.expected_length = expected_length
             expected_offsets = torch.arange(
-                0, offsets.shape[0] * expected_length, expected_length
+                0,
+                offsets.shape[0] * expected_length,
+                expected_length,
+                dtype=offsets.dtype,
+                device=offsets.device,
             )
-            assert all(
-                expected_offsets == offsets
+            # torch.equal() syncs with the device once, not once per element
+            assert torch.equal(
+                expected_offsets, offsets
             ), f"Unexpected offsets for {key} {self.sequence_id}: {offsets}. Expected {expected_offsets}"
 
             data[to_key] = value
@@ -344,11 +495,28 @@ class SlateView:
     def __call__(self, data):
         for k in self.keys:
             value = data[k]
-            _, dim = value.shape
-            data[k] = value.view(-1, self.slate_size, dim)
+            if value.ndim != 2:
+                raise ValueError(f"Wrong shape for key {k}: {value.shape}")
+            data[k] = value.view(-1, self.slate_size, value.shape[1])
 
         return data
 
+    def to_script_module(self) -> torch.nn.Module:
+        return _SlateViewModule(self.keys, self.slate_size)
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        slate_size = _literal(self.slate_size, bind)
+        lines = []
+        for k in self.keys:
+            k = _literal(k, bind)
+            lines += [
+                f"if data[{k}].ndim != 2:",
+                "    raise ValueError("
+                f"'Wrong shape for key {{}}: {{}}'.format({k}, data[{k}].shape))",
+                f"data[{k}] = data[{k}].view(-1, {slate_size}, data[{k}].shape[1])",
+            ]
+        return lines
+
 
 class FixedLengthSequenceDenseNormalization:
     """
@@ -370,13 +538,26 @@ class FixedLengthSequenceDenseNormalization:
         self.dense_normalization = DenseNormalization(
             to_keys, normalization_data, device=device
         )
-        # We will override this in __call__()
-        self.slate_view = SlateView(to_keys, slate_size=-1)
+        self.to_keys = to_keys
+        # If expected_length is not given, it's only known after the first batch
+        # has gone through fixed_length_sequences; the view is built then
+        self.slate_view: Optional[SlateView] = (
+            SlateView(to_keys, slate_size=expected_length)
+            if expected_length is not None
+            else None
+        )
+
+    def to(self, device: torch.device) -> "FixedLengthSequenceDenseNormalization":
+        self.dense_normalization.to(device)
+        return self
 
     def __call__(self, data):
         data = self.fixed_length_sequences(data)
         data = self.dense_normalization(data)
-        self.slate_view.slate_size = self.fixed_length_sequences.expected_length
+        if self.slate_view is None:
+            expected_length = self.fixed_length_sequences.expected_length
+            assert expected_length is not None
+            self.slate_view = SlateView(self.to_keys, slate_size=expected_length)
         return self.slate_view(data)
 
 
@@ -390,35 +571,92 @@ class AppendConstant:
         self.keys = keys
         self.dim = dim
         self.const = const
+        # single-element constants keyed by (dtype, device); they're expanded to
+        # the batch shape, so the cache doesn't grow with the number of shapes
+        self._cache: Dict[Tuple[torch.dtype, torch.device], torch.Tensor] = {}
+
+    def _get_extra_col(self, value: torch.Tensor) -> torch.Tensor:
+        # Same dtype as the result of value * const, with const taken as a float,
+        # e.g., float for int inputs even if const is an int
+        dtype = torch.result_type(value, float(self.const))
+        cache_key = (dtype, value.device)
+        const = self._cache.get(cache_key)
+        if const is None:
+            const = torch.tensor(self.const, dtype=dtype, device=value.device)
+            self._cache[cache_key] = const
+        return const.expand(*value.shape[:-1], 1)
 
     def __call__(self, data):
         for k in self.keys:
             value = data[k]
-            extra_col = self.const * torch.ones(value.shape[:-1]).unsqueeze(-1)
-            data[k] = torch.cat((extra_col, value), dim=self.dim)
+            # torch.cat() copies, so sharing the cached column is safe
+            data[k] = torch.cat((self._get_extra_col(value), value), dim=self.dim)
         return data
 
+    def to_script_module(self) -> torch.nn.Module:
+        return _AppendConstantModule(self.keys, self.dim, self.const)
+
 
 class UnsqueezeRepeat:
     """
     This transform adds an extra dimension to the tensor and repeats
         the tensor along that dimension
+
+    Unless `materialize` is set, the repeated tensor is an expanded view sharing
+        memory with the input; it must not be written to in place.
     """
 
-    def __init__(self, keys: List[str], dim: int, num_repeat: int = 1):
+    def __init__(
+        self, keys: List[str], dim: int, num_repeat: int = 1, materialize: bool = False
+    ):
         self.keys = keys
         self.dim = dim
         self.num_repeat = num_repeat
+        self.materialize = materialize
 
     def __call__(self, data):
         for k in self.keys:
             data[k] = data[k].unsqueeze(self.dim)
             if self.num_repeat != 1:
-                repeat_counters = [1 for _ in range(data[k].ndim)]
-                repeat_counters[self.dim] = self.num_repeat
-                data[k] = data[k].repeat(*repeat_counters)
+                if self.materialize:
+                    repeat_counters = [1 for _ in range(data[k].ndim)]
+                    repeat_counters[self.dim] = self.num_repeat
+                    data[k] = data[k].repeat(*repeat_counters)
+                else:
+                    shape = list(data[k].shape)
+                    shape[self.dim] = self.num_repeat
+                    data[k] = data[k].expand(*shape)
         return data
 
+    def to_script_module(self) -> torch.nn.Module:
+        return _UnsqueezeRepeatModule(
+            self.keys, self.dim, self.num_repeat, self.materialize
+        )
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        dim = _literal(self.dim, bind)
+        num_repeat = _literal(self.num_repeat, bind)
+        lines = []
+        for k in self.keys:
+            k = _literal(k, bind)
+            if self.num_repeat == 1:
+                lines.append(f"data[{k}] = data[{k}].unsqueeze({dim})")
+            elif self.materialize:
+                lines += [
+                    f"value = data[{k}].unsqueeze({dim})",
+                    "repeat_counters = [1] * value.ndim",
+                    f"repeat_counters[{dim}] = {num_repeat}",
+                    f"data[{k}] = value.repeat(*repeat_counters)",
+                ]
+            else:
+                lines += [
+                    f"value = data[{k}].unsqueeze({dim})",
+                    "shape = list(value.shape)",
+                    f"shape[{dim}] = {num_repeat}",
+                    f"data[{k}] = value.expand(*shape)",
+                ]
+        return lines
+
 
 def _get_product_features(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
     """
@@ -437,7 +675,17 @@ def _get_product_features(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
         Output shape:
             (batch, feature_dim_x*feature_dim_y)
     """
-    return torch.einsum("...i,...j->...ij", (x, y)).flatten(start_dim=-2)
+    if (
+        x.ndim == 2
+        and y.ndim == 2
+        and x.shape[0] == y.shape[0]
+        and x.dtype == y.dtype
+        and x.is_floating_point()
+    ):
+        # batched matmul of column and row vectors goes straight to GEMM;
+        # bool and integer inputs lack GEMM kernels on some devices
+        return torch.bmm(x.unsqueeze(2), y.unsqueeze(1)).reshape(x.shape[0], -1)
+    return (x.unsqueeze(-1) * y.unsqueeze(-2)).flatten(start_dim=-2)
 
 
 class OuterProduct:
@@ -445,6 +693,9 @@ class OuterProduct:
     This transform creates a tensor with an outer product of elements of 2 tensors.
     The outer product is stored under the new key.
     The 2 input tensors might be dropped, depending on input arguments
+    If `dtype` is given (e.g., torch.bfloat16 for a model trained in mixed
+        precision), the inputs are cast to it before the product is computed,
+        which halves the size of the (often large) output compared to float32.
     """
 
     def __init__(
@@ -453,36 +704,72 @@ class OuterProduct:
         key2: str,
         output_key: str,
         drop_inputs: bool = False,
+        dtype: Optional[torch.dtype] = None,
     ):
         self.key1 = key1
         self.key2 = key2
         self.output_key = output_key
         self.drop_inputs = drop_inputs
+        self.dtype = dtype
 
     def __call__(self, data):
         x = data[self.key1]
         y = data[self.key2]
+        if self.dtype is not None:
+            x, y = x.to(self.dtype), y.to(self.dtype)
         prod = _get_product_features(x, y)
         data[self.output_key] = prod
         if self.drop_inputs:
             del data[self.key1], data[self.key2]
         return data
 
+    def to_script_module(self) -> torch.nn.Module:
+        return _OuterProductModule(
+            self.key1, self.key2, self.output_key, self.drop_inputs, self.dtype
+        )
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        key1 = _literal(self.key1, bind)
+        key2 = _literal(self.key2, bind)
+        x, y = f"data[{key1}]", f"data[{key2}]"
+        if self.dtype is not None:
+            dtype = bind(self.dtype)
+            x, y = f"{x}.to({dtype})", f"{y}.to({dtype})"
+        lines = [
+            f"data[{_literal(self.output_key, bind)}] = "
+            f"{bind(_get_product_features)}({x}, {y})"
+        ]
+        if self.drop_inputs:
+            lines.append(f"del data[{key1}], data[{key2}]")
+        return lines
+
 
 class GetEye:
     """
     Place a diagonal tensor into the data dictionary
+    The same tensor is placed on every call, so it must not be modified in place.
     """
 
     def __init__(self, key: str, size: int):
         self.key = key
         self.size = size
+        self._eye = torch.eye(size)
+
+    def to(self, device: torch.device) -> "GetEye":
+        self._eye = self._eye.to(device)
+        return self
 
     def __call__(self, data):
-        x = torch.eye(self.size)
-        data[self.key] = x
+        data[self.key] = self._eye
         return data
 
+    def to_script_module(self) -> torch.nn.Module:
+        return _GetEyeModule(self.key, self._eye)
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        # read through the transform, so that `to()` is still picked up
+        return [f"data[{_literal(self.key, bind)}] = {bind(self)}._eye"]
+
 
 def _broadcast_tensors_for_cat(
     tensors: List[torch.Tensor], dim: int
@@ -495,59 +782,141 @@ def _broadcast_tensors_for_cat(
     Input tensors of shapes [(10,3,5), (1,3,3)] (dim=2) would get broadcasted to [(10,3,5), (10,3,3)],
         so that they could be concatenated along the last dim.
     """
+    final_shapes = _get_broadcast_shapes_for_cat([t.shape for t in tensors], dim)
+    return [t.expand(s) for t, s in zip(tensors, final_shapes)]
+
+
+def _get_broadcast_shapes_for_cat(
+    input_shapes: List[torch.Size], dim: int
+) -> List[Tuple[int, ...]]:
+    """
+    Compute the shapes `_broadcast_tensors_for_cat()` expands the tensors to
+    """
     if dim >= 0:
-        dims = [dim] * len(tensors)
+        dims = [dim] * len(input_shapes)
     else:
-        dims = [t.ndim + dim for t in tensors]
-    shapes = [list(t.shape) for t in tensors]
+        dims = [len(s) + dim for s in input_shapes]
+    shapes = [list(s) for s in input_shapes]
     for s, d in zip(shapes, dims):
         s.pop(d)
     shapes_except_cat_dim = [tuple(s) for s in shapes]
     broadcast_shape = torch.broadcast_shapes(*shapes_except_cat_dim)
-    final_shapes = [list(broadcast_shape) for t in tensors]
-    for s, t, d in zip(final_shapes, tensors, dims):
-        s.insert(d, t.shape[dim])
-    final_shapes = [tuple(s) for s in final_shapes]
-    return [t.expand(s) for t, s in zip(tensors, final_shapes)]
+    final_shapes = [list(broadcast_shape) for _ in input_shapes]
+    for s, input_shape, d in zip(final_shapes, input_shapes, dims):
+        s.insert(d, input_shape[dim])
+    return [tuple(s) for s in final_shapes]
 
 
 class Cat:
     """
     This transform concatenates the tensors along a specified dim
+
+    If `reuse_output` is set, the output is written into a buffer that is reused
+        across calls as long as the output shape doesn't change. Each call then
+        overwrites the previous output, so it must not be kept (or written to)
+        beyond the next call.
     """
 
     def __init__(
-        self, input_keys: List[str], output_key: str, dim: int, broadcast: bool = True
+        self,
+        input_keys: List[str],
+        output_key: str,
+        dim: int,
+        broadcast: bool = True,
+        reuse_output: bool = False,
     ):
         self.input_keys = input_keys
         self.output_key = output_key
         self.dim = dim
         self.broadcast = broadcast
+        self.reuse_output = reuse_output
+        self._out: Optional[torch.Tensor] = None
+        # broadcast shapes keyed by input shapes; the schema rarely changes
+        # between batches, so this is nearly always a hit
+        self._plan_cache: Dict[Tuple[torch.Size, ...], List[Tuple[int, ...]]] = {}
 
     def __call__(self, data):
         tensors = []
         for k in self.input_keys:
             tensors.append(data[k])
         if self.broadcast:
-            tensors = _broadcast_tensors_for_cat(tensors, self.dim)
-        data[self.output_key] = torch.cat(tensors, dim=self.dim)
+            input_shapes = tuple(t.shape for t in tensors)
+            final_shapes = self._plan_cache.get(input_shapes)
+            if final_shapes is None:
+                final_shapes = _get_broadcast_shapes_for_cat(
+                    list(input_shapes), self.dim
+                )
+                self._plan_cache[input_shapes] = final_shapes
+            tensors = [t.expand(s) for t, s in zip(tensors, final_shapes)]
+        if self.reuse_output:
+            data[self.output_key] = self._cat_into_buffer(tensors)
+        else:
+            data[self.output_key] = torch.cat(tensors, dim=self.dim)
         return data
 
+    def _cat_into_buffer(self, tensors: List[torch.Tensor]) -> torch.Tensor:
+        out_shape = list(tensors[0].shape)
+        out_shape[self.dim] = sum(t.shape[self.dim] for t in tensors)
+        dtype = tensors[0].dtype
+        for t in tensors[1:]:
+            dtype = torch.promote_types(dtype, t.dtype)
+        out = self._out
+        if (
+            out is None
+            or list(out.shape) != out_shape
+            or out.dtype != dtype
+            or out.device != tensors[0].device
+        ):
+            out = torch.empty(out_shape, dtype=dtype, device=tensors[0].device)
+            self._out = out
+        return torch.cat(tensors, dim=self.dim, out=out)
+
+    def __getstate__(self):
+        # Don't ship the buffer to worker processes
+        state = self.__dict__.copy()
+        state["_out"] = None
+        return state
+
+    def to_script_module(self) -> Optional[torch.nn.Module]:
+        # _broadcast_tensors_for_cat() is not scriptable
+        if self.broadcast:
+            return None
+        return _CatModule(self.input_keys, self.output_key, self.dim)
+
+    def specialize_source(self, bind: Callable[[object], str]) -> Optional[List[str]]:
+        # Broadcasting and the output buffer need the state kept on this transform
+        if self.broadcast or self.reuse_output:
+            return None
+        tensors = ", ".join(f"data[{_literal(k, bind)}]" for k in self.input_keys)
+        return [
+            f"data[{_literal(self.output_key, bind)}] = "
+            f"torch.cat([{tensors}], dim={_literal(self.dim, bind)})"
+        ]
+
 
 class Rename:
     """
     Change key names
+    The keys are renamed in place, unless `copy` is set.
     """
 
-    def __init__(self, old_names: List[str], new_names: List[str]):
+    def __init__(self, old_names: List[str], new_names: List[str], copy: bool = False):
         self.old_names = old_names
         self.new_names = new_names
+        self.copy = copy
 
     def __call__(self, data):
-        new_data = dict(data)
+        if self.copy:
+            data = dict(data)
+        for o, n in zip(self.old_names, self.new_names):
+            data[n] = data.pop(o)
+        return data
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        lines = ["data = dict(data)"] if self.copy else []
         for o, n in zip(self.old_names, self.new_names):
-            new_data[n] = new_data.pop(o)
-        return new_data
+            lines.append(f"data[{_literal(n, bind)}] = data.pop({_literal(o, bind)})")
+        return lines
 
 
 class Filter:
@@ -565,16 +934,281 @@ class Filter:
         assert (keep_keys is None) != (remove_keys is None)
         self.keep_keys = keep_keys
         self.remove_keys = remove_keys
+        self._remove_set = set(remove_keys) if remove_keys is not None else None
 
     def __call__(self, data):
-        if self.keep_keys:
-            new_data = {}
-            for k in self.keep_keys:
-                if k in data:
-                    new_data[k] = data[k]
-        else:
-            new_data = dict(data)
-            for k in self.remove_keys:
-                if k in new_data:
-                    del new_data[k]
-        return new_data
+        if self._remove_set is None:
+            return {k: data[k] for k in self.keep_keys if k in data}
+        return {k: v for k, v in data.items() if k not in self._remove_set}
+
+    def specialize_source(self, bind: Callable[[object], str]) -> List[str]:
+        if self._remove_set is None:
+            keep_keys = bind(tuple(self.keep_keys))
+            return [f"data = {{k: data[k] for k in {keep_keys} if k in data}}"]
+        remove_set = bind(frozenset(self._remove_set))
+        return [f"data = {{k: v for k, v in data.items() if k not in {remove_set}}}"]
+
+
+def _literal(value, bind: Callable[[object], str]) -> str:
+    """
+    Source for `value` in generated code: a literal if it can be written as one,
+    otherwise a name bound to it
+    """
+    if type(value) in (str, int, bool) or value is None:
+        return repr(value)
+    return bind(value)
+
+
+class SpecializedTransforms:
+    """
+    Runs a sequence of transforms as a single function generated at build time
+    (see `Compose.specialize()`).
+    Each transform with a `specialize_source()` method contributes the body of its
+    `__call__()` with its attributes filled in (so there are no attribute lookups
+    or loops over keys at run time). Other transforms are called as is.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+        self.source, self._fn = self._build()
+
+    def _build(self):
+        namespace = {"torch": torch, "F": F}
+
+        def bind(obj) -> str:
+            name = f"_c{len(namespace)}"
+            namespace[name] = obj
+            return name
+
+        lines = ["def specialized(data):"]
+        for t in self.transforms:
+            specialize_source = getattr(t, "specialize_source", None)
+            body = specialize_source(bind) if specialize_source is not None else None
+            if body is None:
+                body = [f"data = {bind(t)}(data)"]
+            lines += [f"    {line}" for line in body]
+        lines.append("    return data")
+        source = "\n".join(lines)
+        exec(compile(source, "<specialized transforms>", "exec"), namespace)
+        return source, namespace["specialized"]
+
+    def __getstate__(self):
+        # The generated function can't be pickled; it's rebuilt on first call
+        state = self.__dict__.copy()
+        state["_fn"] = None
+        return state
+
+    def to(self, device: torch.device) -> "SpecializedTransforms":
+        for t in self.transforms:
+            to = getattr(t, "to", None)
+            if to is not None:
+                to(device)
+        # Rebuild, as the generated code may have bound state replaced by `to()`
+        self.source, self._fn = self._build()
+        return self
+
+    def __call__(self, data):
+        if self._fn is None:
+            self.source, self._fn = self._build()
+        return self._fn(data)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(\n{self.source}\n)"
+
+
+class ScriptedTransforms:
+    """
+    Runs a sequence of tensor-only transform modules (see `Compose.compile()`)
+    as a single TorchScript module.
+    The modules only see the tensor-valued entries of the data; their outputs are
+    merged back into it.
+    """
+
+    def __init__(self, modules: List[torch.nn.Module]):
+        self.module = _SequentialModule(modules)
+        # Scripted modules can't be pickled, so scripting is delayed until
+        # the first call (i.e., in the worker process)
+        self._scripted: Optional[torch.jit.ScriptModule] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_scripted"] = None
+        return state
+
+    def to(self, device: torch.device) -> "ScriptedTransforms":
+        self.module.to(device)
+        if self._scripted is not None:
+            self._scripted.to(device)
+        return self
+
+    def __call__(self, data):
+        if self._scripted is None:
+            self._scripted = torch.jit.script(self.module)
+        tensors = {k: v for k, v in data.items() if isinstance(v, torch.Tensor)}
+        # Without JIT (e.g., PYTORCH_JIT=0) the modules modify `tensors` in place,
+        # so the input keys have to be taken before the call
+        in_keys = set(tensors)
+        out = self._scripted(tensors)
+        for k in in_keys - out.keys():
+            del data[k]
+        data.update(out)
+        return data
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.module})"
+
+
+class _SequentialModule(torch.nn.Module):
+    def __init__(self, modules: List[torch.nn.Module]):
+        super().__init__()
+        self.transforms = torch.nn.ModuleList(modules)
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        for t in self.transforms:
+            data = t(data)
+        return data
+
+
+class _OneHotActionsModule(torch.nn.Module):
+    keys: List[str]
+
+    def __init__(self, keys: List[str], num_actions: int):
+        super().__init__()
+        self.keys = keys
+        self.num_actions = num_actions
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        for k in self.keys:
+            invalid = data[k] == self.num_actions
+            value = data[k].masked_fill(invalid, 0)
+            data[k] = F.one_hot(value, self.num_actions).masked_fill_(
+                invalid.unsqueeze(-1), 0
+            )
+        return data
+
+
+class _SlateViewModule(torch.nn.Module):
+    keys: List[str]
+
+    def __init__(self, keys: List[str], slate_size: int):
+        super().__init__()
+        self.keys = keys
+        self.slate_size = slate_size
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        for k in self.keys:
+            value = data[k]
+            if value.ndim != 2:
+                raise ValueError(f"Wrong shape for key {k}: {value.shape}")
+            data[k] = value.view(-1, self.slate_size, value.shape[1])
+        return data
+
+
+class _AppendConstantModule(torch.nn.Module):
+    keys: List[str]
+
+    def __init__(self, keys: List[str], dim: int, const: float):
+        super().__init__()
+        self.keys = keys
+        self.dim = dim
+        self.const = float(const)
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        for k in self.keys:
+            value = data[k]
+            shape = list(value.shape[:-1])
+            shape.append(1)
+            extra_col = torch.full(
+                shape,
+                self.const,
+                dtype=torch.result_type(value, self.const),
+                device=value.device,
+            )
+            data[k] = torch.cat((extra_col, value), dim=self.dim)
+        return data
+
+
+class _UnsqueezeRepeatModule(torch.nn.Module):
+    keys: List[str]
+
+    def __init__(self, keys: List[str], dim: int, num_repeat: int, materialize: bool):
+        super().__init__()
+        self.keys = keys
+        self.dim = dim
+        self.num_repeat = num_repeat
+        self.materialize = materialize
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        for k in self.keys:
+            value = data[k].unsqueeze(self.dim)
+            if self.num_repeat != 1:
+                shape = list(value.shape)
+                if self.materialize:
+                    repeat_counters = [1 for _ in range(value.ndim)]
+                    repeat_counters[self.dim] = self.num_repeat
+                    value = value.repeat(repeat_counters)
+                else:
+                    shape[self.dim] = self.num_repeat
+                    value = value.expand(shape)
+            data[k] = value
+        return data
+
+
+class _OuterProductModule(torch.nn.Module):
+    dtype: Optional[torch.dtype]
+
+    def __init__(
+        self,
+        key1: str,
+        key2: str,
+        output_key: str,
+        drop_inputs: bool,
+        dtype: Optional[torch.dtype],
+    ):
+        super().__init__()
+        self.key1 = key1
+        self.key2 = key2
+        self.output_key = output_key
+        self.drop_inputs = drop_inputs
+        self.dtype = dtype
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        x = data[self.key1]
+        y = data[self.key2]
+        dtype = self.dtype
+        if dtype is not None:
+            x = x.to(dtype)
+            y = y.to(dtype)
+        data[self.output_key] = _get_product_features(x, y)
+        if self.drop_inputs:
+            del data[self.key1]
+            del data[self.key2]
+        return data
+
+
+class _GetEyeModule(torch.nn.Module):
+    def __init__(self, key: str, eye: torch.Tensor):
+        super().__init__()
+        self.key = key
+        self.register_buffer("eye", eye)
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        data[self.key] = self.eye
+        return data
+
+
+class _CatModule(torch.nn.Module):
+    input_keys: List[str]
+
+    def __init__(self, input_keys: List[str], output_key: str, dim: int):
+        super().__init__()
+        self.input_keys = input_keys
+        self.output_key = output_key
+        self.dim = dim
+
+    def forward(self, data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        tensors: List[torch.Tensor] = []
+        for k in self.input_keys:
+            tensors.append(data[k])
+        data[self.output_key] = torch.cat(tensors, dim=self.dim)
+        return data
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
 
+import pickle
 import unittest
 from copy import deepcopy
 from typing import List
@@ -9,7 +10,9 @@ from unittest.mock import Mock, patch
 import numpy as np
 import reagent.core.types as rlt
 import torch
+from reagent.core.parameters import NormalizationData, NormalizationParameters
 from reagent.preprocessing import transforms
+from reagent.preprocessing.identify_types import CONTINUOUS
 from reagent.preprocessing.types import InputColumn
 
 
@@ -67,6 +70,278 @@ class TestTransforms(unittest.TestCase):
         t2.assert_called_with(2)
         self.assertEqual(out, 3)
 
+    def test_Compose_compile(self):
+        lam = transforms.Lambda(keys=["c"], fn=lambda x: x + 1)
+        compose = transforms.Compose(
+            transforms.OneHotActions(["action"], num_actions=3),
+            transforms.AppendConstant(["a"], const=1.5),
+            lam,
+            transforms.UnsqueezeRepeat(["b"], dim=1, num_repeat=2),
+            transforms.OuterProduct("a", "action", "a_action", drop_inputs=True),
+            transforms.Cat(["b", "b"], "bb", dim=-1, broadcast=False),
+            transforms.GetEye("eye", 2),
+        )
+        compiled = compose.compile()
+        # the Lambda breaks the chain into two scripted spans
+        self.assertEqual(len(compiled.transforms), 3)
+        self.assertIsInstance(compiled.transforms[0], transforms.ScriptedTransforms)
+        self.assertIs(compiled.transforms[1], lam)
+        self.assertIsInstance(compiled.transforms[2], transforms.ScriptedTransforms)
+
+        def make_data():
+            return {
+                "action": torch.tensor([0, 3, 2]),
+                "a": torch.rand(3, 2),
+                "b": torch.rand(3, 4),
+                "c": 1,
+            }
+
+        data = make_data()
+        expected = compose(deepcopy(data))
+        out = compiled(data)
+        self.assertSetEqual(set(out.keys()), set(expected.keys()))
+        self.assertNotIn("a", out)
+        self.assertEqual(out["c"], 2)
+        for k in ["a_action", "b", "bb", "eye"]:
+            self.assertTrue(torch.allclose(out[k], expected[k]), msg=k)
+
+        # the scripted module is dropped when pickled and rebuilt on first call
+        scripted = pickle.loads(pickle.dumps(compiled.transforms[0]))
+        out = scripted({"action": torch.tensor([0, 3]), "a": torch.zeros(2, 1)})
+        self.assertTorchTensorEqual(out["action"], torch.tensor([[1, 0, 0], [0, 0, 0]]))
+        self.assertTorchTensorEqual(out["a"], torch.tensor([[1.5, 0.0], [1.5, 0.0]]))
+
+        # dropped inputs are removed from the batch with JIT on or off
+        # (scripting is a no-op with PYTORCH_JIT=0)
+        for script in [torch.jit.script, lambda m: m]:
+            compiled = transforms.Compose(
+                transforms.OuterProduct("a", "b", "ab", drop_inputs=True)
+            ).compile()
+            with patch.object(torch.jit, "script", side_effect=script):
+                out = compiled({"a": torch.rand(2, 1), "b": torch.rand(2, 2), "z": 1})
+            self.assertListEqual(sorted(out.keys()), ["ab", "z"])
+
+    @patch("reagent.preprocessing.transforms.Preprocessor")
+    def test_Compose_to(self, Preprocessor):
+        device = torch.device("meta")
+        dn = transforms.DenseNormalization(keys=["a"], normalization_data=Mock())
+        eye = transforms.GetEye("eye", 2)
+        lam = transforms.Lambda(keys=["a"], fn=lambda x: x)
+        compose = transforms.Compose(dn, eye, lam, device=device)
+        self.assertEqual(dn.device, device)
+        self.assertEqual(Preprocessor.call_args.kwargs["device"], device)
+        self.assertEqual(eye._eye.device, device)
+
+        compiled = transforms.Compose(transforms.GetEye("eye", 2)).compile()
+        compiled.to(device)
+        self.assertEqual(compiled.transforms[0].module.transforms[0].eye.device, device)
+
+        # compiling after moving keeps the device
+        compiled = transforms.Compose(
+            transforms.GetEye("eye", 2), device=device
+        ).compile()
+        self.assertEqual(compiled.transforms[0].module.transforms[0].eye.device, device)
+
+    @patch("reagent.preprocessing.transforms.make_sparse_preprocessor")
+    def test_MapIDListFeatures_to(self, mock_make_sparse_preprocessor):
+        device = torch.device("meta")
+        feature_config = rlt.ModelFeatureConfig()
+        map_id_list_features = transforms.MapIDListFeatures(
+            id_list_keys=[],
+            id_score_list_keys=[],
+            feature_config=feature_config,
+            device=torch.device("cpu"),
+        )
+        transforms.Compose(map_id_list_features, device=device)
+        mock_make_sparse_preprocessor.assert_called_with(
+            feature_config=feature_config, device=device
+        )
+
+    def test_Compose_specialize(self):
+        def make_compose():
+            return transforms.Compose(
+                transforms.ValuePresence(),
+                transforms.MaskByPresence(["m"]),
+                transforms.OneHotActions(["action"], num_actions=3),
+                transforms.AppendConstant(["a"], const=1.5),
+                transforms.Lambda(keys=["c"], fn=abs),
+                transforms.UnsqueezeRepeat(["b"], dim=1, num_repeat=2),
+                transforms.UnsqueezeRepeat(["d"], dim=0, materialize=True),
+                transforms.OuterProduct("a", "action", "a_action", drop_inputs=True),
+                transforms.SlateView(["s"], slate_size=2),
+                transforms.Cat(["b", "b"], "bb", dim=-1, broadcast=False),
+                transforms.Cat(["m", "m"], "mm", dim=-1),
+                transforms.GetEye("eye", 2),
+                transforms.Rename(["bb"], ["bb2"]),
+                transforms.Filter(remove_keys=["d"]),
+            )
+
+        def make_data():
+            rand_gen = torch.Generator().manual_seed(0)
+            return {
+                "m": torch.rand(3, 2, generator=rand_gen),
+                "m_presence": torch.rand(3, 2, generator=rand_gen) > 0.5,
+                "action": torch.tensor([0, 3, 2]),
+                "a": torch.rand(3, 2, generator=rand_gen),
+                "b": torch.rand(3, 4, generator=rand_gen),
+                "c": -1,
+                "d": torch.rand(3, generator=rand_gen),
+                "s": torch.rand(4, 3, generator=rand_gen),
+            }
+
+        expected = make_compose()(make_data())
+        specialized = make_compose().specialize()
+        # attributes are baked in
+        self.assertIn("data['bb2'] = data.pop('bb')", specialized.source)
+        self.assertIn("view(-1, 2, data['s'].shape[1])", specialized.source)
+        for out in [
+            specialized(make_data()),
+            pickle.loads(pickle.dumps(specialized))(make_data()),
+        ]:
+            self.assertSetEqual(set(out.keys()), set(expected.keys()))
+            self.assertEqual(out["c"], 1)
+            for k in expected.keys() - {"c"}:
+                self.assertTrue(torch.allclose(out[k], expected[k]), msg=k)
+
+        # `to()` reaches the specialized transforms, also inside another Compose
+        device = torch.device("meta")
+        compose = transforms.Compose(
+            transforms.Compose(transforms.GetEye("eye", 2)).specialize()
+        )
+        self.assertIs(compose.to(device), compose)
+        self.assertEqual(compose({})["eye"].device, device)
+
+    def test_to_script_module(self):
+        # each transform, its module run eagerly, and its scripted module agree
+        cases = [
+            (
+                transforms.OneHotActions(["x"], num_actions=3),
+                {"x": torch.tensor([0, 3, 2])},
+            ),
+            (transforms.SlateView(["x"], slate_size=2), {"x": torch.rand(4, 3)}),
+            (transforms.AppendConstant(["x"], const=1.5), {"x": torch.rand(3, 2)}),
+            (
+                transforms.AppendConstant(["x"], const=1.5),
+                {"x": torch.tensor([[1, 2]])},
+            ),
+            (
+                transforms.AppendConstant(["x"], const=1),
+                {"x": torch.tensor([[1, 2]])},
+            ),
+            (
+                transforms.UnsqueezeRepeat(["x"], dim=1, num_repeat=1),
+                {"x": torch.rand(3, 2)},
+            ),
+            (
+                transforms.UnsqueezeRepeat(["x"], dim=1, num_repeat=3),
+                {"x": torch.rand(3, 2)},
+            ),
+            (
+                transforms.UnsqueezeRepeat(
+                    ["x"], dim=-1, num_repeat=3, materialize=True
+                ),
+                {"x": torch.rand(3, 2)},
+            ),
+            (
+                transforms.OuterProduct("x", "y", "xy", drop_inputs=True),
+                {"x": torch.rand(3, 2), "y": torch.rand(3, 4)},
+            ),
+            (
+                transforms.OuterProduct("x", "y", "xy", dtype=torch.double),
+                {"x": torch.rand(3, 2), "y": torch.rand(3, 4)},
+            ),
+            (transforms.GetEye("x", 3), {}),
+            (
+                transforms.Cat(["x", "y"], "xy", dim=0, broadcast=False),
+                {"x": torch.rand(3, 2), "y": torch.rand(1, 2)},
+            ),
+        ]
+        for t, data in cases:
+            module = t.to_script_module()
+            expected = t(deepcopy(data))
+            for out in [
+                module(deepcopy(data)),
+                torch.jit.script(module)(deepcopy(data)),
+            ]:
+                self.assertSetEqual(set(out.keys()), set(expected.keys()), msg=t)
+                for k in expected.keys():
+                    self.assertEqual(out[k].dtype, expected[k].dtype, msg=t)
+                    self.assertEqual(out[k].shape, expected[k].shape, msg=t)
+                    self.assertTrue(torch.equal(out[k], expected[k]), msg=t)
+
+    def test_specialize_source(self):
+        # each transform with a template agrees with its specialized source
+        cases = [
+            (
+                transforms.OneHotActions(["x", "y"], num_actions=3),
+                {"x": torch.tensor([0, 3, 2]), "y": torch.tensor([[1], [3]])},
+            ),
+            (transforms.SlateView(["x"], slate_size=2), {"x": torch.rand(4, 3)}),
+            (
+                transforms.UnsqueezeRepeat(["x"], dim=1, num_repeat=1),
+                {"x": torch.rand(3, 2)},
+            ),
+            (
+                transforms.UnsqueezeRepeat(["x"], dim=1, num_repeat=3),
+                {"x": torch.rand(3, 2)},
+            ),
+            (
+                transforms.UnsqueezeRepeat(
+                    ["x"], dim=-1, num_repeat=3, materialize=True
+                ),
+                {"x": torch.rand(3, 2)},
+            ),
+            (
+                transforms.OuterProduct("x", "y", "xy"),
+                {"x": torch.rand(3, 2), "y": torch.rand(3, 4)},
+            ),
+            (
+                transforms.OuterProduct(
+                    "x", "y", "xy", drop_inputs=True, dtype=torch.double
+                ),
+                {"x": torch.rand(3, 2), "y": torch.rand(3, 4)},
+            ),
+            (transforms.GetEye("x", 3), {}),
+            (
+                transforms.Cat(["x", "y"], "xy", dim=0, broadcast=False),
+                {"x": torch.rand(3, 2), "y": torch.rand(1, 2)},
+            ),
+            (
+                transforms.Rename(["x", "y"], ["y", "z"]),
+                {"x": torch.rand(1), "y": torch.rand(2)},
+            ),
+            (
+                transforms.Rename(["x"], ["z"], copy=True),
+                {"x": torch.rand(1), "y": torch.rand(2)},
+            ),
+            (
+                transforms.Filter(keep_keys=["x", "z"]),
+                {"x": torch.rand(1), "y": torch.rand(2)},
+            ),
+            (
+                transforms.Filter(remove_keys=["x", "z"]),
+                {"x": torch.rand(1), "y": torch.rand(2)},
+            ),
+        ]
+        for t, data in cases:
+            self.assertIsNotNone(t.specialize_source(lambda obj: "_"), msg=t)
+            specialized = transforms.Compose(t).specialize()
+            expected_data = deepcopy(data)
+            expected = t(expected_data)
+            out_data = deepcopy(data)
+            out = specialized(out_data)
+            self.assertListEqual(list(out.keys()), list(expected.keys()), msg=t)
+            for k in expected.keys():
+                self.assertEqual(out[k].dtype, expected[k].dtype, msg=t)
+                self.assertEqual(out[k].shape, expected[k].shape, msg=t)
+                self.assertEqual(out[k].stride(), expected[k].stride(), msg=t)
+                self.assertTrue(torch.equal(out[k], expected[k]), msg=t)
+            # the input dict is modified (or not) the same way
+            self.assertListEqual(
+                list(out_data.keys()), list(expected_data.keys()), msg=t
+            )
+            self.assertEqual(out is out_data, expected is expected_data, msg=t)
+
     def test_ValuePresence(self):
         vp = transforms.ValuePresence()
         d1 = {"a": 1, "a_presence": 0, "b": 2}
@@ -87,6 +362,33 @@ class TestTransforms(unittest.TestCase):
         out = mbp(data)
         self.assertEqual(out["a"], expected["a"])
         self.assertEqual(out["b"], expected["b"])
+
+        data = {
+            "a": (torch.tensor([1.0, 2.0]), torch.tensor([False, True])),
+            "b": (torch.tensor([3.0, 4.0]), torch.tensor([1.0, 0.0])),
+        }
+        out = mbp(data)
+        self.assertEqual(out["a"], torch.tensor([0.0, 2.0]))
+        self.assertEqual(out["b"], torch.tensor([3.0, 0.0]))
+        self.assertEqual(out["a"].dtype, torch.float)
+        # NaN at non-present positions isn't masked, whatever the presence dtype
+        data = {
+            "a": (torch.tensor([torch.nan, 2.0]), torch.tensor([False, True])),
+            "b": (torch.tensor([torch.nan, 2.0]), torch.tensor([0.0, 1.0])),
+        }
+        out = mbp(data)
+        for k in ["a", "b"]:
+            self.assertTrue(torch.isnan(out[k][0]), msg=k)
+            self.assertEqual(out[k][1], torch.tensor(2.0))
+        # non-float values are still cast to float
+        data = {
+            "a": (torch.tensor([1, 2]), torch.tensor([False, True])),
+            "b": (torch.tensor([3, 4]), torch.tensor([1, 0])),
+        }
+        out = mbp(data)
+        self.assertEqual(out["a"].dtype, torch.float)
+        self.assertEqual(out["b"].dtype, torch.float)
+
         with self.assertRaisesRegex(Exception, "Not valid value"):
             data2 = {
                 "a": torch.tensor(1),
@@ -189,6 +491,55 @@ class TestTransforms(unittest.TestCase):
         self.assertEqual(torch.stack(in_1), torch.stack(a_in))
         self.assertEqual(torch.stack(in_2), torch.stack(b_in))
 
+    def test_DenseNormalization_fuse_keys(self):
+        normalization_data = NormalizationData(
+            dense_normalization_parameters={
+                1: NormalizationParameters(
+                    feature_type=CONTINUOUS, mean=1.0, stddev=2.0
+                ),
+                2: NormalizationParameters(
+                    feature_type=CONTINUOUS, mean=0.0, stddev=1.0
+                ),
+            }
+        )
+        rand_gen = torch.Generator().manual_seed(0)
+        a_value = torch.rand(3, 2, generator=rand_gen)
+        a_value[0, 1] = torch.nan
+        b_value = torch.rand(4, 2, generator=rand_gen)
+        data = {
+            "a": (a_value, torch.ones(3, 2)),
+            "b": (b_value, torch.rand(4, 2, generator=rand_gen) > 0.5),
+        }
+        expected = transforms.DenseNormalization(
+            keys=["a", "b"], normalization_data=normalization_data
+        )(deepcopy(data))
+        out = transforms.DenseNormalization(
+            keys=["a", "b"], normalization_data=normalization_data, fuse_keys=True
+        )(data)
+        for k in ["a", "b"]:
+            self.assertEqual(out[k].shape, expected[k].shape)
+            self.assertTrue(torch.allclose(out[k], expected[k]), msg=k)
+
+    def test_DenseNormalization_pickle(self):
+        normalization_data = NormalizationData(
+            dense_normalization_parameters={
+                1: NormalizationParameters(
+                    feature_type=CONTINUOUS, mean=1.0, stddev=2.0
+                ),
+            }
+        )
+        dn = transforms.DenseNormalization(
+            keys=["a"], normalization_data=normalization_data
+        )
+        self.assertIsNotNone(dn._preprocessor)
+        dn_copy = pickle.loads(pickle.dumps(dn))
+        self.assertIsNone(dn_copy._preprocessor)
+
+        data = {"a": (torch.tensor([[3.0], [torch.nan]]), torch.tensor([[1], [1]]))}
+        out = dn_copy(data)
+        self.assertIsNotNone(dn_copy._preprocessor)
+        self.assertTorchTensorEqual(out["a"], torch.tensor([[1.0], [0.0]]))
+
     @patch("reagent.preprocessing.transforms.Preprocessor")
     def test_FixedLengthSequenceDenseNormalization(self, Preprocessor):
         # test key mapping
@@ -295,6 +646,9 @@ class TestTransforms(unittest.TestCase):
             out["b:1"], b_TN.view(b_batch_size, expected_length, b_dim)
         )
 
+        # the slate size is resolved once, from the first batch
+        self.assertEqual(flsdn.slate_view.slate_size, expected_length)
+
     @patch("reagent.preprocessing.transforms.make_sparse_preprocessor")
     def test_MapIDListFeatures(self, mock_make_sparse_preprocessor):
         data = {
@@ -409,6 +763,13 @@ class TestTransforms(unittest.TestCase):
         }
         self.assertDictOfTensorEqual(data_out, expected)
 
+        # batched input
+        data_in = {"0": torch.tensor([2, 1, 0])}
+        data_out = transforms.OneHotActions(["0"], num_actions)(data_in)
+        self.assertTorchTensorEqual(
+            data_out["0"], torch.tensor([[0, 0], [0, 1], [1, 0]])
+        )
+
     def test_FixedLengthSequences(self):
         # of form {sequence_id: (offsets, Tuple(Tensor, Tensor))}
         a_T = (torch.tensor([0, 1]), torch.tensor([1, 0]))
@@ -536,6 +897,17 @@ class TestTransforms(unittest.TestCase):
         self.assertEqual(out["a"].shape, torch.Size([2, 2, 3]))
         self.assertDictOfTensorEqual({"a": a_out_223}, out)
 
+        # GIVEN slate.size = 2 and keys = ["a"]
+        # WHEN input is not 2D
+        # THEN a ValueError should be raised, scripted or not
+        sv.slate_size = 2
+        sv.keys = ["a"]
+        for t in [sv, torch.jit.script(sv.to_script_module())]:
+            with self.assertRaisesRegex(Exception, "Wrong shape for key a"):
+                t({"a": torch.zeros(6, 2, 3)})
+        with self.assertRaisesRegex(ValueError, "Wrong shape for key a"):
+            transforms.Compose(sv).specialize()({"a": torch.zeros(6, 2, 3)})
+
     def _check_same_keys(self, dict_a, dict_b):
         self.assertSetEqual(set(dict_a.keys()), set(dict_b.keys()))
 
@@ -552,24 +924,54 @@ class TestTransforms(unittest.TestCase):
             t_data["a"], torch.tensor([[1.5, 9.0, 4.5], [1.5, 3.4, 3.9]])
         )
 
+        # the constant column follows the dtype of the input
+        data = {"a": torch.tensor([[9.0, 4.5], [3.4, 3.9]], dtype=torch.double)}
+        t_data = t(data)
+        self.assertEqual(t_data["a"].dtype, torch.double)
+        self.assertTorchTensorEqual(
+            t_data["a"],
+            torch.tensor([[1.5, 9.0, 4.5], [1.5, 3.4, 3.9]], dtype=torch.double),
+        )
+
+        # int inputs are promoted, not the constant truncated
+        t_data = t({"a": torch.tensor([[1, 2]])})
+        self.assertEqual(t_data["a"].dtype, torch.float)
+        self.assertTorchTensorEqual(t_data["a"], torch.tensor([[1.5, 1.0, 2.0]]))
+        # including when the constant itself is an int
+        t_int = transforms.AppendConstant(["a"], const=1)
+        t_data = t_int({"a": torch.tensor([[1, 2]])})
+        self.assertEqual(t_data["a"].dtype, torch.float)
+        self.assertTorchTensorEqual(t_data["a"], torch.tensor([[1.0, 1.0, 2.0]]))
+
+        # one cached constant per (dtype, device), whatever the batch shape
+        t({"a": torch.ones(5, 2)})
+        self.assertEqual(len(t._cache), 2)
+
     def test_UnsqueezeRepeat(self):
         data = {
             "a": torch.tensor([[9.0, 4.5], [3.4, 3.9]]),
             "b": torch.tensor([[9.2, 2.5], [4.4, 1.9]]),
         }
+        expected = torch.tensor(
+            [
+                [[9.0, 4.5], [9.0, 4.5], [9.0, 4.5]],
+                [[3.4, 3.9], [3.4, 3.9], [3.4, 3.9]],
+            ]
+        )
+        a = data["a"]
         t = transforms.UnsqueezeRepeat(["a"], dim=1, num_repeat=3)
         t_data = t(data)
         self._check_same_keys(data, t_data)
         self.assertTorchTensorEqual(data["b"], t_data["b"])
-        self.assertTorchTensorEqual(
-            t_data["a"],
-            torch.tensor(
-                [
-                    [[9.0, 4.5], [9.0, 4.5], [9.0, 4.5]],
-                    [[3.4, 3.9], [3.4, 3.9], [3.4, 3.9]],
-                ]
-            ),
-        )
+        self.assertTorchTensorEqual(t_data["a"], expected)
+        # by default the result is a view of the input
+        self.assertEqual(t_data["a"].data_ptr(), a.data_ptr())
+
+        t = transforms.UnsqueezeRepeat(["a"], dim=1, num_repeat=3, materialize=True)
+        t_data = t({"a": a})
+        self.assertEqual(tuple(t_data["a"].shape), (2, 3, 2))
+        self.assertTorchTensorEqual(t_data["a"], expected)
+        self.assertNotEqual(t_data["a"].data_ptr(), a.data_ptr())
 
     def test_OuterProduct(self):
         data = {
@@ -589,6 +991,65 @@ class TestTransforms(unittest.TestCase):
             ).flatten()
         self.assertTorchTensorEqual(t_data["ab"], expected_out)
 
+        for t in [
+            transforms.OuterProduct("a", "b", "ab", dtype=torch.bfloat16),
+            transforms.Compose(
+                transforms.OuterProduct("a", "b", "ab", dtype=torch.bfloat16)
+            ).compile(),
+        ]:
+            t_data = t(dict(data))
+            self.assertEqual(t_data["ab"].dtype, torch.bfloat16)
+            self.assertTrue(
+                torch.allclose(t_data["ab"].float(), expected_out, rtol=1e-2)
+            )
+
+    def test_get_product_features(self):
+        x = torch.rand(3, 4, 2)
+        y = torch.rand(3, 4, 5)
+        expected_out = torch.einsum("...i,...j->...ij", (x, y)).flatten(start_dim=-2)
+        out = transforms._get_product_features(x, y)
+        self.assertEqual(tuple(out.shape), (3, 4, 10))
+        self.assertTrue(torch.allclose(out, expected_out))
+
+        out = transforms._get_product_features(x[:, 0], y[:, 0])
+        self.assertEqual(tuple(out.shape), (3, 10))
+        self.assertTrue(torch.allclose(out, expected_out[:, 0]))
+
+        # mixed dtypes are promoted
+        out = transforms._get_product_features(x[:, 0], torch.tensor([[1, 0]] * 3))
+        self.assertEqual(out.dtype, torch.float)
+        self.assertTrue(torch.equal(out[:, 1::2], torch.zeros(3, 2)))
+        self.assertTrue(torch.equal(out[:, 0::2], x[:, 0]))
+
+        # leading dims are broadcast
+        for x_shape, y_shape in [
+            ((1, 3), (5, 4)),
+            ((5, 3), (4,)),
+            ((5, 3), (1, 5, 4)),
+        ]:
+            x = torch.rand(*x_shape)
+            y = torch.rand(*y_shape)
+            expected_out = torch.einsum("...i,...j->...ij", (x, y)).flatten(
+                start_dim=-2
+            )
+            out = transforms._get_product_features(x, y)
+            self.assertEqual(out.shape, expected_out.shape)
+            self.assertTrue(torch.allclose(out, expected_out))
+
+        # bool and integer inputs keep their dtype
+        x = torch.tensor([[True, False], [True, True]])
+        y = torch.tensor([[True, False, True], [False, True, True]])
+        out = transforms._get_product_features(x, y)
+        self.assertEqual(out.dtype, torch.bool)
+        self.assertTrue(
+            torch.equal(out, (x.unsqueeze(-1) & y.unsqueeze(-2)).flatten(1))
+        )
+        out = transforms._get_product_features(x.long(), y.long() * 2)
+        self.assertEqual(out.dtype, torch.long)
+        self.assertTrue(
+            torch.equal(out, 2 * (x.unsqueeze(-1) & y.unsqueeze(-2)).flatten(1))
+        )
+
     def test_GetEye(self):
         data = {
             "a": torch.tensor([[9.0, 4.5], [3.4, 3.9]]),
@@ -601,6 +1062,8 @@ class TestTransforms(unittest.TestCase):
         self.assertTorchTensorEqual(data["b"], t_data["b"])
 
         self.assertTorchTensorEqual(t_data["c"], torch.eye(4))
+        # the tensor is built once
+        self.assertIs(t({})["c"], t_data["c"])
 
     def test_Cat(self):
         data = {
@@ -615,18 +1078,48 @@ class TestTransforms(unittest.TestCase):
 
         self.assertTorchTensorEqual(t_data["c"], torch.cat([data["a"], data["b"]], 0))
 
+        # broadcast shapes are cached per input shapes
+        t = transforms.Cat(["a", "b"], "c", -1)
+        for _ in range(2):
+            t_data = t({"a": torch.ones(3, 2), "b": torch.zeros(1, 4)})
+            self.assertTorchTensorEqual(
+                t_data["c"], torch.cat([torch.ones(3, 2), torch.zeros(3, 4)], -1)
+            )
+        self.assertEqual(len(t._plan_cache), 1)
+        t_data = t({"a": torch.ones(1, 2), "b": torch.zeros(5, 1)})
+        self.assertEqual(tuple(t_data["c"].shape), (5, 3))
+        self.assertEqual(len(t._plan_cache), 2)
+
+        # output buffer is reused as long as the output shape is the same
+        t = transforms.Cat(["a", "b"], "c", 0, reuse_output=True)
+        c1 = t(dict(data))["c"]
+        self.assertTorchTensorEqual(c1, torch.cat([data["a"], data["b"]], 0))
+        c2 = t({"a": data["b"], "b": data["a"]})["c"]
+        self.assertEqual(c1.data_ptr(), c2.data_ptr())
+        self.assertTorchTensorEqual(c2, torch.cat([data["b"], data["a"]], 0))
+        c3 = t({"a": data["a"], "b": data["b"][:1]})["c"]
+        self.assertEqual(tuple(c3.shape), (3, 2))
+
     def test_Rename(self):
         data = {
             "a": torch.tensor([[9.0, 4.5], [3.4, 3.9]]),
             "b": torch.tensor([[9.2, 2.5], [4.4, 1.9]]),
         }
-        t = transforms.Rename(["a"], ["aa"])
+        t = transforms.Rename(["a"], ["aa"], copy=True)
         t_data = t(data)
         # make sure original data was left unmodified
         self.assertTorchTensorEqual(data["b"], t_data["b"])
 
         self.assertTorchTensorEqual(t_data["aa"], data["a"])
 
+        # by default the keys are renamed in place
+        a = data["a"]
+        t = transforms.Rename(["a"], ["aa"])
+        t_data = t(data)
+        self.assertIs(t_data, data)
+        self.assertListEqual(sorted(t_data.keys()), ["aa", "b"])
+        self.assertIs(t_data["aa"], a)
+
     def test_Filter(self):
         data = {
             "a": torch.tensor([[9.0, 4.5], [3.4, 3.9]]),